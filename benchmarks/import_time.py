@@ -0,0 +1,128 @@
+#!/usr/bin/python3
+# Measures the startup latency of the commands, by running each of them in fresh python processes, and checks
+# that they don't import more than they need to (e.g. show-plan shouldn't import pyVmomi). Appends the results
+# to a JSON lines file with --history, so the startup latency can be tracked over time
+import argparse
+import importlib.util
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules the commands should only import when they need them, and the commands that need them
+heavy_modules = [ "pyVmomi", "pyVim", "pynetbox", "requests", "urllib3", "http.server" ]
+allowed_modules = { "python": heavy_modules,
+                    "apply": [ "pynetbox", "requests", "urllib3" ] }
+
+# Packages the commands can't run without, the commands are skipped when they aren't installed
+required_modules = { "apply": [ "pynetbox", "requests", "urllib3" ] }
+
+def get_scenarios(tmp):
+    # apply replays an empty plan, netbox isn't contacted for that
+    plan_file = os.path.join(tmp, "plan.json")
+    with open(plan_file, "w") as f:
+        json.dump( { "version": 1, "created": time.time(), "units": {}, "changes": [] }, f )
+
+    options = [ "--log-file", os.path.join(tmp, "netbox-sync.log"), "--journal", os.path.join(tmp, "netbox-sync-journal.jsonl") ]
+    return { "python": [ "-c", "pass" ],
+             "import": [ "-c", "import netbox_sync.cli" ],
+             "help": [ "-m", "netbox_sync", "--help" ],
+             "validate-config": [ "-m", "netbox_sync", "validate-config" ],
+             "show-plan": [ "-m", "netbox_sync", "show-plan", plan_file ],
+             "apply": [ "-m", "netbox_sync" ] + options + [ "apply", plan_file ] }
+
+def run(python_args, importtime = False):
+    env = dict(os.environ, PYTHONPATH = repo_dir)
+    for name in [ "VCENTER_HOSTNAME", "VCENTER_USERNAME", "VCENTER_PASSWORD", "NETBOX_API_TOKEN", "NETBOX_WEBHOOK_SECRET" ]:
+        env[name] = "benchmark"
+    env["NETBOX_API_URI"] = "http://netbox.invalid"
+    # Startup should be measured with the .pyc files, like an installed package
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    args = [ sys.executable ]
+    if importtime:
+        args += [ "-X", "importtime" ]
+
+    started = time.perf_counter()
+    result = subprocess.run(args + python_args, env = env, cwd = repo_dir, stdout = subprocess.DEVNULL, stderr = subprocess.PIPE, text = True)
+    elapsed = time.perf_counter() - started
+
+    if result.returncode != 0:
+        print(result.stderr, file = sys.stderr)
+        raise SystemExit(f"{' '.join(python_args)} failed with exit code {result.returncode}")
+    return elapsed, result.stderr
+
+def get_imported_modules(importtime_output):
+    # Lines look like: "import time:       123 |        456 |   package.module"
+    modules = {}
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = int(cumulative)
+    return modules
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Measure the startup latency of update-netbox-from-vmware commands")
+    parser.add_argument("--runs", type=int, default=20,
+                        help="Number of runs per command, the median is reported (default: %(default)s)")
+    parser.add_argument("--history",
+                        help="JSON lines file to append the results to")
+    parser.add_argument("--max-ms", type=float,
+                        help="Fail if the median startup time of a command (minus the python startup time) is above this")
+    return parser.parse_args()
+
+def main():
+    args = parse_arguments()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {}
+        skipped = {}
+        failed = False
+        for name, python_args in get_scenarios(tmp).items():
+            missing = [ x for x in required_modules.get(name, []) if importlib.util.find_spec(x) is None ]
+            if missing:
+                skipped[name] = missing
+                continue
+
+            # The first run warms up the file system cache and writes the .pyc files, it isn't counted
+            _, importtime_output = run(python_args, importtime = True)
+            modules = get_imported_modules(importtime_output)
+            timings = [ run(python_args)[0] for _ in range(args.runs) ]
+
+            results[name] = { "median_ms": round(statistics.median(timings) * 1000, 1),
+                              "min_ms": round(min(timings) * 1000, 1),
+                              "modules": len(modules) }
+
+            unwanted = [ x for x in heavy_modules if x in modules and x not in allowed_modules.get(name, []) ]
+            if unwanted:
+                results[name]["unwanted_imports"] = unwanted
+                failed = True
+
+    baseline = results["python"]["median_ms"]
+    print(f"{'command':<16} {'median ms':>10} {'min ms':>10} {'-python ms':>11} {'modules':>8}")
+    for name, result in results.items():
+        over_python = result["median_ms"] - baseline
+        print(f"{name:<16} {result['median_ms']:>10} {result['min_ms']:>10} {over_python:>11.1f} {result['modules']:>8}")
+
+        if "unwanted_imports" in result:
+            print(f"  {name} imports: {', '.join(result['unwanted_imports'])}")
+        if args.max_ms is not None and name != "python" and over_python > args.max_ms:
+            print(f"  {name} is above --max-ms: {args.max_ms}")
+            failed = True
+    for name, missing in skipped.items():
+        print(f"{name:<16} skipped, not installed: {', '.join(missing)}")
+
+    if args.history:
+        with open(args.history, "a") as f:
+            f.write(json.dumps( { "time": time.time(), "python": sys.version.split()[0], "runs": args.runs, "results": results, "skipped": skipped } ) + "\n")
+
+    if failed:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,2 @@
+# Updates netbox with the clusters and VMs from vSphere, the command line is in netbox_sync.cli.
+# Keep this free of imports, every command imports it
@@ -0,0 +1,3 @@
+from netbox_sync.cli import main
+
+main()
@@ -0,0 +1,1874 @@
+import atexit
+import ipaddress
+import logging 
+import logging.handlers
+import os
+import sys
+import json
+import queue
+import random
+import signal
+import functools
+import argparse
+import collections
+import threading
+import time
+
+# pynetbox, requests, pyVmomi etc. are imported by the functions using them, so commands that don't talk to
+# vcenter (or netbox) don't pay for importing them, see benchmarks/import_time.py
+
+# Additional custom attributes to push from vcenter -> netbox custom fields, leave it empty [] if 
+# you don't want to push any extra vcenter custom attributes from the vcenter.
+netbox_custom_fields = [{ "netbox_fieldname" : "SystemID", "vcenter_custom_attribute" : "SystemID" }]
+
+# Comment added to netbox clusters/VMs that no longer exists in vcenter
+missing_in_vcenter_comment = "No longer present in vCenter, verify manually, and delete this object in netbox"
+
+vcenter_session = None
+vcenter_content = None
+netbox_client = None
+logger = None
+vm_logger = None
+log_listener = None
+
+vcenter_vms = []
+vcenter_clusters = []
+netbox_vms = []
+netbox_clusters = []
+netbox_interfaces = []
+netbox_interfaces_by_vm = collections.defaultdict(list)
+netbox_ip_addresses_by_address = collections.defaultdict(list)
+netbox_ip_addresses_by_interface = collections.defaultdict(list)
+
+# Netbox updates that failed, even after the HTTP level retries, see queue_retry()
+retry_queue = []
+retry_queue_passes = 3
+retry_backoff = 0.5
+
+# Checkpoints for resuming an interrupted run (--resume), see initialize_journal()
+journal = None
+
+# Profiling (--profile), see initialize_profiling()
+profile_enabled = False
+profile_slow_vm_threshold = 2.0
+profile_output = "netbox-sync-profile.folded"
+profiler = None
+profile_last_snapshot = None
+profile_last_phase_time = None
+profile_function_timings = collections.defaultdict(lambda: [0, 0.0])
+
+class VMwareCluster:
+    def __init__(self, name, vcenter_persistent_id, hosts):
+        self.name = name
+        self.vcenter_persistent_id = vcenter_persistent_id
+        self.hosts = hosts
+
+class NetboxCluster:
+    def __init__(self, name, vcenter_persistent_id, raw_netbox_api_record):
+        self.name = name
+        self.vcenter_persistent_id = vcenter_persistent_id
+        self.raw_netbox_api_record = raw_netbox_api_record
+
+class GenericVM:
+    def __init__(self, name, persistent_id, vcpu, memory_mb, disk_gb, comment, nics = None, custom_fields = None, interface_sync_enabled = False):
+        self.name = name
+        self.persistent_id = persistent_id
+        # Netbox doesn't require vcpus/memory/disk, so they might be empty
+        self.vcpu = int(vcpu) if vcpu is not None else None
+        self.memory_mb = int(memory_mb) if memory_mb is not None else None
+        self.disk_gb = int(disk_gb) if disk_gb is not None else None
+        self.comment = comment
+        if nics is None:
+            nics = []
+        self.nics = nics
+        if custom_fields is None:
+            custom_fields = []
+        self.custom_fields = custom_fields
+        if interface_sync_enabled is None:
+            interface_sync_enabled = False
+        self.interface_sync_enabled = interface_sync_enabled
+
+    def __repr__(self):
+        return str.format("{{name: {0}, persistent_id: {1}, nics: {2}, vcpu: {3}, memory_mb: {4}, disk_gb: {5}, comment: {6}, custom_fields: {7}, interface_sync_enabled: {8} }}", 
+            self.name,
+            self.persistent_id,
+            self.nics,
+            self.vcpu,
+            self.memory_mb,
+            self.disk_gb,
+            self.comment,
+            self.custom_fields,
+            self.interface_sync_enabled)
+
+    def __eq__(self, other):
+        if isinstance(other, GenericVM):
+            # We purposely do not include interface_sync_enabled in the comparison, since the vcenter has no idea about it
+            return (self.name == other.name and
+                   self.persistent_id == other.persistent_id and
+                   self.nics == other.nics and
+                   self.vcpu == other.vcpu and
+                   self.memory_mb == other.memory_mb and
+                   self.disk_gb == other.disk_gb and 
+                   self.comment == other.comment and
+                   self.custom_fields == other.custom_fields)
+        return False
+
+class GenericNetworkInterface:
+    def __init__(self, name, mac_address, connected, ip_addresses = None, netbox_id = None):
+        self.name = name
+        self.connected = connected
+        self.mac_address = str(mac_address).upper()
+        if ip_addresses is None:
+            ip_addresses = []
+        self.ip_addresses = ip_addresses
+        # Only set for interfaces from netbox, not part of the comparison
+        self.netbox_id = netbox_id
+    
+    def __repr__(self):
+        return str.format("{{name: {0}, mac_address: {1}, connected: {2}, ip_addresses: {3} }}",
+            self.name,
+            self.mac_address,
+            self.connected,
+            self.ip_addresses)
+
+    def __eq__(self, other):
+        if isinstance(other, GenericNetworkInterface):
+            return ( self.name == other.name and
+                     self.connected == other.connected and
+                     self.mac_address == other.mac_address and
+                     self.ip_addresses == other.ip_addresses)
+        return False
+
+class VMwareVM:
+    def __init__(self, name, uuid, vcpu, memory_mb, disk_gb, comment, power_state, vmtools_status, nics, primary_ipaddress, is_template, custom_attributes, cluster_name ):
+        self.name = name
+        self.uuid = uuid
+        self.vcpu = vcpu
+        self.memory_mb = memory_mb
+        self.disk_gb = int(disk_gb)
+        self.comment = comment
+        self.power_state = power_state
+        self.vmtools_status = vmtools_status
+        self.nics = nics
+        self.primary_ipaddress = primary_ipaddress
+        self.is_template = is_template
+        self.custom_attributes = custom_attributes
+        self.cluster_name = cluster_name
+
+class NetboxVM:
+    def __init__(self, name, vcenter_persistent_id, raw_netbox_api_record):
+            self.name = name
+            self.vcenter_persistent_id = vcenter_persistent_id
+            self.raw_netbox_api_record = raw_netbox_api_record
+
+class NetboxInterface:
+    def __init__(self, raw_netbox_api_record, netbox_vm_id):
+            self.raw_netbox_api_record = raw_netbox_api_record
+            self.netbox_vm_id = netbox_vm_id
+
+class SamplingProfiler:
+    # Periodically samples the stacks of all running threads, and counts identical stacks, so the
+    # result can be written in the "folded" format used by flamegraph.pl / speedscope / inferno
+    def __init__(self, interval = 0.005):
+        self.interval = interval
+        self.samples = collections.Counter()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        own_thread_id = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            thread_names = { x.ident: x.name for x in threading.enumerate() }
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread_id:
+                    continue
+
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(thread_names.get(thread_id, str(thread_id)))
+                stack.reverse()
+
+                self.samples[";".join(stack)] += 1
+
+    def write_folded(self, filename):
+        with open(filename, "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+class ChangePlan:
+    # Every change needed to bring netbox in sync with vcenter, worked out without writing anything to netbox.
+    # Changes belong to a unit (a cluster or VM), can depend on other changes, and can refer to the id of an
+    # object created by another change with { "$ref": change_id }. Saved as JSON, so it can be applied later
+    def __init__(self, units = None, changes = None, created = None):
+        if units is None:
+            units = {}
+        self.units = units
+        if changes is None:
+            changes = []
+        self.changes = changes
+        if created is None:
+            created = time.time()
+        self.created = created
+
+    def add_unit(self, key, action, name, vcenter_persistent_id):
+        self.units[key] = { "action": action, "name": name, "vcenter_persistent_id": vcenter_persistent_id }
+
+    def add(self, unit, action, object_type, target = None, data = None, depends_on = None):
+        change = { "id": len(self.changes) + 1,
+                   "unit": unit,
+                   "action": action,
+                   "object": object_type,
+                   "target": target,
+                   "data": data or {},
+                   "depends_on": depends_on or [] }
+        self.changes.append(change)
+        return change["id"]
+
+    def save(self, filename):
+        with open(filename + ".tmp", "w") as f:
+            json.dump( { "version": 1, "created": self.created, "units": self.units, "changes": self.changes }, f, default=str )
+        os.replace(filename + ".tmp", filename)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename) as f:
+            plan = json.load(f)
+        return cls( units = plan["units"], changes = plan["changes"], created = plan["created"] )
+
+class PlanApplier:
+    # Applies the changes of a ChangePlan to netbox, a dependency level at a time (e.g. VMs before their
+    # interfaces, interfaces before the IP addresses assigned to them). Within a level, changes of the same
+    # kind are sent as concurrent bulk requests of up to batch_size objects. If a bulk request fails, its
+    # changes are applied one at a time, and the ones that still fail are queued for retry
+    action_order = [ "create", "update", "assign_ip", "delete" ]
+
+    def __init__(self, plan, changes_by_unit, concurrency, batch_size):
+        # changes_by_unit holds the changes to apply, grouped by the unit (cluster/VM) they belong to
+        self.plan = plan
+        self.changes = [ x for changes in changes_by_unit.values() for x in changes ]
+        self.changes_by_id = { x["id"]: x for x in plan.changes }
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.created_ids = {}
+        self._pending = collections.Counter( { unit: len(changes) for unit, changes in changes_by_unit.items() } )
+        self._applied = collections.defaultdict(list)
+        self._lock = threading.Lock()
+
+    def run(self):
+        import concurrent.futures
+
+        queued_before = len(retry_queue)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers = self.concurrency, thread_name_prefix = "apply") as executor:
+            for level, changes in enumerate(self._dependency_levels()):
+                for action in self.action_order:
+                    groups = collections.defaultdict(list)
+                    for change in changes:
+                        if change["action"] == action:
+                            groups[change["object"]].append(change)
+
+                    futures = []
+                    for object_type, group in groups.items():
+                        logger.info("Applying %s %s changes to %s objects (dependency level %s)", len(group), action, object_type, level)
+                        if self._bulk_supported(action, object_type):
+                            for i in range(0, len(group), self.batch_size):
+                                futures.append( executor.submit(self._apply_batch, action, object_type, group[i:i + self.batch_size]) )
+                        else:
+                            for change in group:
+                                futures.append( executor.submit(self._apply_or_queue, change) )
+
+                    for future in concurrent.futures.as_completed(futures):
+                        future.result()
+
+        logger.info("Applied the plan, %s changes were queued for retry", len(retry_queue) - queued_before)
+
+    def _dependency_levels(self):
+        # Changes only depend on changes planned before them, so a single pass is enough. Dependencies that
+        # are not part of this run (completed by the run we are resuming) are already in netbox
+        level_of = {}
+        levels = []
+        for change in sorted(self.changes, key=lambda x: x["id"]):
+            level = 1 + max( (level_of.get(x, -1) for x in change["depends_on"]), default=-1 )
+            level_of[change["id"]] = level
+            while len(levels) <= level:
+                levels.append([])
+            levels[level].append(change)
+        return levels
+
+    def _bulk_supported(self, action, object_type):
+        # Bulk updates and deletes needs pynetbox 6.4 or newer
+        endpoint = _netbox_endpoint(object_type)
+        if action == "create":
+            return True
+        if action == "delete":
+            return hasattr(endpoint, "delete")
+        return hasattr(endpoint, "update")
+
+    def _apply_batch(self, action, object_type, changes):
+        endpoint = _netbox_endpoint(object_type)
+
+        if action == "create" and any(x["unit"] in journal.in_flight for x in changes):
+            # The run we are resuming might have created some of them, apply_change() checks for that
+            for change in changes:
+                self._apply_or_queue(change)
+            return
+
+        try:
+            if action == "create":
+                records = endpoint.create([ self._resolve(x["data"]) for x in changes ])
+            elif action == "delete":
+                endpoint.delete([ x["target"] for x in changes ])
+            else:
+                endpoint.update([ dict(self._resolve(x["data"]), id = x["target"]) for x in changes ])
+        except Exception as ex:
+            # Bulk requests are all or nothing in netbox, but the response can be lost after netbox committed them
+            # (e.g. a proxy 502 or a connection reset), so look for the objects before creating them one at a time
+            logger.debug("Bulk %s of %s %s objects failed (%s), applying them one at a time", action, len(changes), object_type, ex)
+            for change in changes:
+                self._apply_or_queue(change, action == "create")
+            return
+
+        if action == "create":
+            for change, record in zip(changes, records):
+                self._applied_change(change, record.id)
+        else:
+            for change in changes:
+                self._applied_change(change)
+
+    def _apply_or_queue(self, change, check_existing = False):
+        try:
+            self.apply_change(change, check_existing)
+        except Exception as ex:
+            description = f"{change['action']} {change['object']} for: {self.plan.units[change['unit']]['name']}"
+            vm_logger.warn("Failed to %s in netbox", description)
+            vm_logger.exception(ex)
+            # Look for the object before creating it again, the create might have gone through, even if we didn't get the response
+            queue_retry(description, self._apply_or_queue, change, True)
+
+    def apply_change(self, change, check_existing = False):
+        endpoint = _netbox_endpoint(change["object"])
+        data = self._resolve(change["data"])
+
+        if change["action"] == "create":
+            record = None
+            if check_existing or change["unit"] in journal.in_flight:
+                record = self._find_existing(change["object"], data)
+            if record is None:
+                record = endpoint.create(data)
+            self._applied_change(change, record.id)
+            return
+
+        record = endpoint.get(change["target"])
+        if record is None:
+            vm_logger.warn("The %s with id: %s no longer exists in netbox, skipping the %s", change["object"], change["target"], change["action"])
+        elif change["action"] == "delete":
+            record.delete()
+        else:
+            for key, value in data.items():
+                setattr(record, key, value)
+            record.save()
+
+        self._applied_change(change)
+
+    def _find_existing(self, object_type, data):
+        endpoint = _netbox_endpoint(object_type)
+        if object_type == "cluster":
+            return endpoint.get(name = data["name"])
+        if object_type == "virtual_machine":
+            return next( (x for x in endpoint.filter(name = data["name"])
+                          if x.custom_fields.get('vcenter_persistent_id') == data["custom_fields"]["vcenter_persistent_id"]), None )
+        if object_type == "interface":
+            return endpoint.get(virtual_machine_id = data["virtual_machine"], mac_address = data["mac_address"])
+        return None
+
+    def _resolve(self, data):
+        # Replaces references to objects created by other changes, with their netbox id
+        resolved = {}
+        for key, value in data.items():
+            if isinstance(value, dict) and "$ref" in value:
+                value = self._created_id(value["$ref"])
+            resolved[key] = value
+        return resolved
+
+    def _created_id(self, change_id):
+        with self._lock:
+            if change_id in self.created_ids:
+                return self.created_ids[change_id]
+
+        # Created by the run we are resuming, or the change failed, in which case it won't be found
+        change = self.changes_by_id[change_id]
+        record = self._find_existing(change["object"], self._resolve(change["data"]))
+        if record is None:
+            raise LookupError(f"Depends on the {change['action']} of the {change['object']} in change: {change_id}, which hasn't been applied")
+
+        with self._lock:
+            self.created_ids[change_id] = record.id
+        return record.id
+
+    def _applied_change(self, change, created_id = None):
+        unit = change["unit"]
+        with self._lock:
+            if created_id is not None:
+                self.created_ids[change["id"]] = created_id
+            self._applied[unit].append(change)
+            self._pending[unit] -= 1
+            unit_done = self._pending[unit] == 0
+
+        if unit_done:
+            journal.done(unit)
+            log_vm_summary(self.plan.units[unit]["action"],
+                           self.plan.units[unit]["name"],
+                           self.plan.units[unit]["vcenter_persistent_id"],
+                           [ { "action": x["action"], "object": x["object"], "target": x["target"], "data": x["data"] } for x in self._applied[unit] ])
+
+class RunJournal:
+    # Append-only JSON lines file, that records which reconciliation units (a cluster or VM) are done,
+    # and the changes in flight for the unit being worked on, so an interrupted run can be resumed.
+    # Lines are flushed but not fsync'ed, they survive the process being killed, which is what we care about
+    def __init__(self, filename):
+        self.filename = filename
+        self.completed = set()
+        self.in_flight = {}
+        self._file = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if not os.path.exists(self.filename):
+            return False
+
+        with open(self.filename) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # The last line might be cut off, if the process died while writing it
+                    break
+
+                if "in_flight" in entry:
+                    self.in_flight[entry["in_flight"]] = entry["changes"]
+                elif "done" in entry:
+                    self.completed.add(entry["done"])
+                    self.in_flight.pop(entry["done"], None)
+        return True
+
+    def open(self, resume):
+        self._file = open(self.filename, "a" if resume else "w")
+        self._write( { "run": { "started": time.time(), "pid": os.getpid(), "resume": resume } } )
+
+    def is_done(self, key):
+        return key in self.completed
+
+    def record_changes(self, key, changes):
+        self._write( { "in_flight": key, "changes": changes } )
+
+    def done(self, key):
+        self.completed.add(key)
+        self._write( { "done": key } )
+
+    def finish(self):
+        self._file.close()
+        os.remove(self.filename)
+
+    def _write(self, entry):
+        line = json.dumps(entry, default=str) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+class JsonLogFormatter(logging.Formatter):
+    # One JSON object per line, used with --log-mode compact
+    def format(self, record):
+        entry = { "time": self.formatTime(record),
+                  "level": record.levelname,
+                  "function": record.funcName,
+                  "message": record.getMessage() }
+
+        vm_summary = getattr(record, "vm_summary", None)
+        if vm_summary is not None:
+            entry.update(vm_summary)
+
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+
+        return json.dumps(entry, default=str)
+
+class BackgroundQueueHandler(logging.handlers.QueueHandler):
+    # The default QueueHandler formats the whole record in the calling thread, we only merge the
+    # message arguments (so later changes to the logged objects doesn't change the message), and
+    # leave the timestamp/formatting and the console/file I/O to the QueueListener thread
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            # The traceback has to be rendered now, while the frames it references are still intact
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+class MirrorRecord(dict):
+    # The objects in the netbox mirror are plain JSON, this gives them the same attribute access as the
+    # pynetbox records (e.g. vm.cluster.id), so the rest of the sync can't tell them apart
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+class NetboxMirror:
+    # Local copy of the netbox clusters, VMs, interfaces and IP addresses, stored the way the netbox API returns
+    # them. Seeded with a full fetch, and kept up to date from the netbox webhooks by the webhook-listen command,
+    # so sync/plan runs can read netbox from disk (--netbox-mirror), instead of fetching everything every run
+    webhook_models = { "cluster": "cluster",
+                       "virtualmachine": "virtual_machine",
+                       "vminterface": "interface",
+                       "interface": "interface",
+                       "ipaddress": "ip_address" }
+
+    # Saved at least this often, even without changes, so readers can tell the listener is still running
+    heartbeat_interval = 60
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.objects = { x: {} for x in self.webhook_models.values() }
+        # Deleted objects (version, time of the delete) by id, so late updates can't bring them back, see _apply()
+        self.deleted = { x: {} for x in self.webhook_models.values() }
+        self.seeded_at = None
+        self.updated_at = None
+        self.dirty = False
+        self._events_while_seeding = []
+        self._lock = threading.Lock()
+
+    def seed(self):
+        # Events received while fetching are applied again afterwards, they might be newer than what was fetched
+        with self._lock:
+            if self._events_while_seeding is None:
+                self._events_while_seeding = []
+
+        try:
+            objects = {}
+            for object_type in self.objects:
+                objects[object_type] = { str(x.id): dict(x) for x in _netbox_endpoint(object_type).all() }
+        finally:
+            with self._lock:
+                events, self._events_while_seeding = self._events_while_seeding, None
+
+        with self._lock:
+            self.objects = objects
+
+            # Deletes from before the previous seed can't have updates still in flight
+            for deleted in self.deleted.values():
+                for key in [ x for x, (_, deleted_at) in deleted.items() if self.seeded_at is None or deleted_at < self.seeded_at ]:
+                    del deleted[key]
+
+            for event in events:
+                self._apply(event)
+            self.seeded_at = time.time()
+            self.dirty = True
+
+        logger.info("Seeded the netbox mirror with %s", ", ".join(f"{x}: {len(y)}" for x, y in objects.items()))
+
+    def apply_event(self, payload):
+        # Returns True if the event changed the mirror
+        with self._lock:
+            if self._events_while_seeding is not None:
+                self._events_while_seeding.append(payload)
+            return self._apply(payload)
+
+    def _apply(self, payload):
+        object_type = self.webhook_models.get(payload.get("model"))
+        data = payload.get("data")
+        if object_type is None or not isinstance(data, dict) or "id" not in data:
+            return False
+
+        # Older netbox versions use the same interface model for devices and VMs
+        if object_type == "interface" and data.get("virtual_machine") is None:
+            return False
+
+        objects = self.objects[object_type]
+        deleted = self.deleted[object_type]
+        key = str(data["id"])
+        version = str(data.get("last_updated") or payload.get("timestamp") or "")
+
+        if payload.get("event") == "deleted":
+            # Always removed, when replayed after a seed, the object was fetched before it was deleted
+            if key not in deleted or version > deleted[key][0]:
+                deleted[key] = ( version, time.time() )
+            if objects.pop(key, None) is None:
+                return False
+        else:
+            # Webhooks can be delivered out of order, don't replace an object with an older version of it, and
+            # don't bring back a deleted object, with an update that was sent before it was deleted
+            if key in deleted and version <= deleted[key][0]:
+                return False
+
+            current = objects.get(key)
+            if current is not None and version < str(current.get("last_updated") or ""):
+                return False
+            objects[key] = data
+
+        self.dirty = True
+        return True
+
+    def save(self):
+        # Written to a temporary file first, so readers never see a half written mirror
+        with self._lock:
+            self.updated_at = time.time()
+            self.dirty = False
+            content = json.dumps( { "version": 1, "seeded_at": self.seeded_at, "updated_at": self.updated_at, "objects": self.objects }, default=str )
+
+        with open(self.filename + ".tmp", "w") as f:
+            f.write(content)
+        os.replace(self.filename + ".tmp", self.filename)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename) as f:
+            content = json.load(f, object_hook=MirrorRecord)
+
+        mirror = cls(filename)
+        mirror.objects = content["objects"]
+        mirror.seeded_at = content["seeded_at"]
+        mirror.updated_at = content["updated_at"]
+        return mirror
+
+    def records(self, object_type):
+        return list(self.objects[object_type].values())
+
+    def status(self):
+        # Taken under the lock, webhooks and seeding change the objects from other threads
+        with self._lock:
+            return { "seeded_at": self.seeded_at,
+                     "updated_at": self.updated_at,
+                     "objects": { x: len(y) for x, y in self.objects.items() } }
+
+def profiled(func):
+    # Keeps a call count and cumulative wall time per function when --profile is enabled, reported by finish_profiling()
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not profile_enabled:
+            return func(*args, **kwargs)
+
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            timing = profile_function_timings[func.__name__]
+            timing[0] += 1
+            timing[1] += time.perf_counter() - started
+    return wrapper
+
+def profile_slow_vm(phase, vm_name, started):
+    if not profile_enabled:
+        return
+
+    elapsed = time.perf_counter() - started
+    if elapsed > profile_slow_vm_threshold:
+        logger.warn("Slow VM: %s took %.3fs in %s (threshold: %ss)", vm_name, elapsed, phase, profile_slow_vm_threshold)
+
+def profile_phase(phase):
+    # Called at each phase boundary, logs how long the phase took, and the top allocation sites
+    # since the previous phase boundary, based on tracemalloc snapshots
+    global profile_last_snapshot
+    global profile_last_phase_time
+
+    if not profile_enabled:
+        return
+
+    import tracemalloc
+
+    now = time.perf_counter()
+    snapshot = tracemalloc.take_snapshot().filter_traces([ tracemalloc.Filter(False, tracemalloc.__file__) ])
+    current, peak = tracemalloc.get_traced_memory()
+
+    logger.info("Profile: phase %s took %.3fs, traced memory: %.1f MB (peak: %.1f MB)", phase, now - profile_last_phase_time, current / 1024 / 1024, peak / 1024 / 1024)
+
+    if profile_last_snapshot is not None:
+        top_stats = snapshot.compare_to(profile_last_snapshot, "lineno")
+    else:
+        top_stats = snapshot.statistics("lineno")
+
+    for stat in top_stats[:10]:
+        logger.info("Profile: phase %s top allocation: %s", phase, stat)
+
+    profile_last_snapshot = snapshot
+    profile_last_phase_time = now
+
+def queue_retry(description, func, *args):
+    # Failed netbox updates are retried at the end of the run by drain_retry_queue(), instead of
+    # being skipped until the next run. func should queue itself again if it fails again
+    vm_logger.warn("Queued for retry at the end of the run: %s", description)
+    retry_queue.append( (description, func, args) )
+
+def drain_retry_queue():
+    global retry_queue
+
+    for retry_pass in range(1, retry_queue_passes + 1):
+        if not retry_queue:
+            return
+
+        pending = retry_queue
+        retry_queue = []
+
+        # Back off between passes, in case netbox is still struggling
+        delay = retry_backoff * (2 ** retry_pass)
+        delay = delay / 2 + random.uniform(0, delay / 2)
+        logger.info("Retrying %s failed netbox updates in %.1fs (pass %s of %s)", len(pending), delay, retry_pass, retry_queue_passes)
+        time.sleep(delay)
+
+        for description, func, args in pending:
+            logger.info("Retrying: %s", description)
+            func(*args)
+
+    for description, func, args in retry_queue:
+        logger.error("Giving up on: %s, after %s retry passes", description, retry_queue_passes)
+
+def log_vm_summary(action, vm_name, persistent_id, changes):
+    # One line per changed VM, with --log-mode compact this replaces the per VM detail lines
+    logger.info("VM %s: %s", action, vm_name, extra={ "vm_summary": { "action": action,
+                                                                      "vm": vm_name,
+                                                                      "vcenter_persistent_id": persistent_id,
+                                                                      "changes": changes } })
+
+@functools.lru_cache(maxsize=32)
+def get_vcenter_clusters():
+    global vcenter_clusters
+    
+    # Get a list of datacenters in the vcenter
+    vcenter_datacenters = vcenter_content.rootFolder.childEntity
+
+    # We only have one datacenter, but lets loop through the list of them anyway
+    for vcenter_datacenter in vcenter_datacenters:
+        for vcenter_cluster in vcenter_datacenter.hostFolder.childEntity:
+            hosts = [ x._moId for x in vcenter_cluster.host ]
+            vcenter_clusters.append( VMwareCluster( name = vcenter_cluster.name, 
+                                                    vcenter_persistent_id = vcenter_cluster._moId,
+                                                    hosts = hosts ) )
+
+def get_netbox_clusters(nb_clusters = None):
+    global netbox_clusters
+
+    # The records are passed in when they are read from the netbox mirror, see load_netbox_mirror()
+    if nb_clusters is None:
+        try:
+            nb_clusters = netbox_client.virtualization.clusters.all()
+        except Exception as ex: 
+            logger.error("Failed getting a list of netbox clusters")
+            logger.exception(ex)
+            raise SystemExit(-1)
+    
+    for nb_cluster in nb_clusters:
+        if nb_cluster.type.name == "vSphere":
+            netbox_clusters.append( NetboxCluster( name = nb_cluster.name,
+                                                   vcenter_persistent_id = nb_cluster.custom_fields.get('vcenter_persistent_id'),
+                                                   raw_netbox_api_record = nb_cluster) )
+
+def get_netbox_interfaces(nb_interfaces = None):
+    global netbox_interfaces
+
+    # The records are passed in when they are read from the netbox mirror, see load_netbox_mirror()
+    if nb_interfaces is None:
+        try:
+            nb_interfaces = netbox_client.virtualization.interfaces.all()
+        except Exception as ex: 
+            logger.error("Failed getting a list of netbox interfaces")
+            logger.exception(ex)
+            raise SystemExit(-1)
+    
+    for nb_interface in nb_interfaces:
+        netbox_interface = NetboxInterface( raw_netbox_api_record = nb_interface,
+                                            netbox_vm_id = nb_interface.virtual_machine.id )
+        netbox_interfaces.append( netbox_interface )
+        netbox_interfaces_by_vm[netbox_interface.netbox_vm_id].append( netbox_interface )
+
+def get_netbox_ip_addresses(nb_ips = None):
+    # All IP addresses are fetched up front, instead of looking them up for every VM/nic, indexed by the
+    # address (the IP addresses we can assign) and by the VM interface they are assigned to
+    if nb_ips is None:
+        try:
+            nb_ips = netbox_client.ipam.ip_addresses.all()
+        except Exception as ex: 
+            logger.error("Failed getting a list of netbox ip addresses")
+            logger.exception(ex)
+            raise SystemExit(-1)
+
+    for nb_ip in nb_ips:
+        # Normalized the same way as the IP addresses from vcenter
+        address = str(ipaddress.ip_interface(nb_ip.address))
+        netbox_ip_addresses_by_address[address].append( nb_ip )
+
+        # IP addresses can be assigned to device interfaces too, their ids overlap with the VM interfaces
+        if nb_ip.interface is not None and nb_ip.interface.virtual_machine is not None:
+            netbox_ip_addresses_by_interface[nb_ip.interface.id].append( address )
+
+def plan_netbox_changes():
+    # Works out everything that needs to change in netbox, from the inventories fetched up front,
+    # nothing is written to netbox here, see apply_plan() for that
+    plan = ChangePlan()
+    created_clusters = plan_netbox_clusters(plan)
+    plan_netbox_vms(plan, created_clusters)
+
+    logger.info("Planned %s changes for %s clusters/VMs", len(plan.changes), len(plan.units))
+    return plan
+
+def plan_netbox_clusters(plan):
+    # Returns the clusters that will be created, by name, so VMs in them can refer to them
+    created_clusters = {}
+    vcenter_cluster_ids = { x.vcenter_persistent_id for x in vcenter_clusters }
+    netbox_cluster_ids = { x.vcenter_persistent_id for x in netbox_clusters }
+
+    # Find clusters present in netbox, but not in vsphere, and add comment
+    # about it, on the netbox cluster object
+    for nbc1 in netbox_clusters:
+        if nbc1.vcenter_persistent_id in vcenter_cluster_ids:
+            logger.info("Cluster: %s with vCenter_ID: %s exists in vcenter, nothing to do", nbc1.name, nbc1.vcenter_persistent_id)
+        elif nbc1.raw_netbox_api_record.comments == missing_in_vcenter_comment:
+            logger.info("Cluster: %s with vCenter_ID: %s does NOT exists in vcenter, and is already marked as such in netbox", nbc1.name, nbc1.vcenter_persistent_id)
+        else:
+            logger.info("Cluster: %s with vCenter_ID: %s does NOT exists in vcenter, adding comment to netbox", nbc1.name, nbc1.vcenter_persistent_id)
+
+            unit = f"netbox_cluster:{nbc1.raw_netbox_api_record.id}"
+            plan.add(unit, "update", "cluster", target = nbc1.raw_netbox_api_record.id, data = { "comments": missing_in_vcenter_comment })
+            plan.add_unit(unit, "missing_in_vcenter", nbc1.name, nbc1.vcenter_persistent_id)
+
+    # Find clusters present in vcenter, but not in netbox
+    cluster_type = None
+    for vc2 in vcenter_clusters:
+        if vc2.vcenter_persistent_id in netbox_cluster_ids:
+            logger.info("Cluster: %s with vCenter_ID: %s exists in netbox, nothing to do", vc2.name, vc2.vcenter_persistent_id)
+            continue
+
+        logger.info("Cluster: %s with vCenter_ID: %s does NOT exists in netbox, adding the cluster to netbox", vc2.name, vc2.vcenter_persistent_id)
+
+        # Get the cluster type for vsphere, the first time we need it
+        if cluster_type is None:
+            try:
+                cluster_type = netbox_client.virtualization.cluster_types.get(name="vSphere")
+            except Exception as ex:
+                logger.warn("Failed getting the vSphere cluster type from netbox, can't create the cluster")
+                logger.exception(ex)
+                continue
+
+            if cluster_type is None:
+                logger.warn("There is no vSphere cluster type in netbox, can't create the cluster: %s", vc2.name)
+                continue
+
+        custom_fields = {}
+        custom_fields["vcenter_persistent_id"] = vc2.vcenter_persistent_id
+
+        unit = f"vcenter_cluster:{vc2.vcenter_persistent_id}"
+        change_id = plan.add(unit, "create", "cluster", data = { "name": vc2.name,
+                                                                 "type": cluster_type.id,
+                                                                 "custom_fields": custom_fields })
+        plan.add_unit(unit, "create", vc2.name, vc2.vcenter_persistent_id)
+        created_clusters[vc2.name] = change_id
+
+    return created_clusters
+
+def plan_netbox_vms(plan, created_clusters):
+    vcenter_vms_by_uuid = { x.uuid: x for x in vcenter_vms }
+    netbox_vm_ids = { x.vcenter_persistent_id for x in netbox_vms }
+
+    # Find VMs present in netbox, but not in vsphere, and add comment about it, on the netbox VM object.
+    # And update existing vms with latest information from vcenter if they already exists, and something has changed.
+    for nbvm1 in netbox_vms:
+        vm_started = time.perf_counter()
+        vcvm = vcenter_vms_by_uuid.get(nbvm1.vcenter_persistent_id)
+        if vcvm is not None:
+            _plan_netbox_vm_update(plan, nbvm1, vcvm)
+        elif nbvm1.raw_netbox_api_record.comments == missing_in_vcenter_comment:
+            vm_logger.info("VM: %s with vCenter_ID: %s does NOT exists in vcenter, and is already marked as such in netbox", nbvm1.name, nbvm1.vcenter_persistent_id)
+        else:
+            vm_logger.info("VM: %s with vCenter_ID: %s does NOT exists in vcenter, adding comment to netbox", nbvm1.name, nbvm1.vcenter_persistent_id)
+
+            unit = f"netbox_vm:{nbvm1.raw_netbox_api_record.id}"
+            plan.add(unit, "update", "virtual_machine", target = nbvm1.raw_netbox_api_record.id, data = { "comments": missing_in_vcenter_comment })
+            plan.add_unit(unit, "missing_in_vcenter", nbvm1.name, nbvm1.vcenter_persistent_id)
+        profile_slow_vm("plan_netbox_vms", nbvm1.name, vm_started)
+
+    # Find vms present in vcenter, but not in netbox
+    for vcvm2 in vcenter_vms:
+        if vcvm2.uuid in netbox_vm_ids:
+            vm_logger.info("VM: %s with vCenter_ID: %s exists in netbox, nothing to do", vcvm2.name, vcvm2.uuid)
+        else:
+            vm_started = time.perf_counter()
+            _plan_netbox_vm_create(plan, vcvm2, created_clusters)
+            profile_slow_vm("plan_netbox_vms", vcvm2.name, vm_started)
+
+@profiled
+def _plan_netbox_vm_update(plan, nbvm1, vcvm):
+    vm_logger.info("VM: %s with vCenter_ID: %s exists in vcenter, checking if anything has changed", nbvm1.name, nbvm1.vcenter_persistent_id)
+
+    # Convert the netbox and vcenter VM objects into a base VM, we can compare to each other etc.
+    nb_basevm = _get_basevm_from_netbox_vm(nbvm1)
+    vc_basevm = _get_basevm_from_vcenter_vm(vcvm)
+
+    # Check if there is any differences between the vcenter/netbox VM object, bail early, if they are equal
+    if nb_basevm == vc_basevm:
+        vm_logger.info("The VM object: %s in both Netbox and vcenter looks the same, skipping early since there is no change.", nb_basevm.name)
+        return
+
+    unit = f"netbox_vm:{nbvm1.raw_netbox_api_record.id}"
+    planned = len(plan.changes)
+
+    # Figure out what exactly changed between netbox <> vcenter for the VM
+    data = {}
+    if vc_basevm.vcpu != nb_basevm.vcpu:
+        vm_logger.info("Found change (vcpu), VC VM vcpu: %s, NB VM vcpu: %s", vc_basevm.vcpu, nb_basevm.vcpu)
+        data["vcpus"] = vcvm.vcpu
+    if vc_basevm.memory_mb != nb_basevm.memory_mb:
+        vm_logger.info("Found change (memory), VC VM memory: %s, NB VM memory: %s", vc_basevm.memory_mb, nb_basevm.memory_mb)
+        data["memory"] = vcvm.memory_mb
+    if vc_basevm.comment != nb_basevm.comment and nb_basevm.comment is not None:
+        vm_logger.info("Found change (comment), VC VM comment: %s, NB VM comment: %s", vc_basevm.comment, nb_basevm.comment)
+        data["comments"] = vcvm.comment
+    if nb_basevm.disk_gb is None or vc_basevm.disk_gb != nb_basevm.disk_gb:
+        vm_logger.info("Found change (disk), VC VM disk size (GB): %s, NB VM disk size (GB): %s", vc_basevm.disk_gb, nb_basevm.disk_gb)
+        data["disk"] = vcvm.disk_gb
+
+    # Our company specific custom netbox attribute, if it's defined, ignored otherwise
+    # TODO: This should be optimized better to handle any custem fields, not just our own
+    if "SystemID" in vcvm.custom_attributes and "SystemID" in nbvm1.raw_netbox_api_record.custom_fields:
+        vc_SystemID = vcvm.custom_attributes["SystemID"]
+        nb_SystemID = nbvm1.raw_netbox_api_record.custom_fields["SystemID"]
+
+        # Strip whitespaces in case the vcenter returns an empty string
+        if vc_SystemID != nb_SystemID and len(vc_SystemID.strip()) > 0:
+            vm_logger.info("Found change, VC VM SystemID: %s, NB VM SystemID: %s", vc_SystemID, nb_SystemID)
+            # Only the field we change, netbox merges it with the other custom fields, so edits made
+            # in netbox between planning and applying (e.g. interface_sync_enabled) are kept
+            data["custom_fields"] = { "SystemID": vc_SystemID }
+
+    if data:
+        plan.add(unit, "update", "virtual_machine", target = nbvm1.raw_netbox_api_record.id, data = data)
+
+    # Check if the VM has interface sync enabled, if so, check if there is any changes
+    if nb_basevm.interface_sync_enabled:
+        if nb_basevm.nics != vc_basevm.nics:
+            vm_logger.info("Found change (nics), VC VM nics: %s, NB VM nics: %s", vc_basevm.nics, nb_basevm.nics)
+            _plan_netbox_vm_interfaces(plan, unit, nb_basevm, vc_basevm, nbvm1.raw_netbox_api_record.id)
+
+    if len(plan.changes) > planned:
+        plan.add_unit(unit, "update", nbvm1.name, nbvm1.vcenter_persistent_id)
+    else:
+        vm_logger.info("No changes detected for VM: %s", nbvm1.name)
+
+@profiled
+def _plan_netbox_vm_create(plan, vcvm2, created_clusters):
+    vm_logger.info("VM: %s with vCenter_ID: %s does NOT exists in netbox, adding the VM to netbox", vcvm2.name, vcvm2.uuid)
+
+    unit = f"vcenter_vm:{vcvm2.uuid}"
+    depends_on = []
+
+    netbox_cluster_id = _netbox_get_cluster_id(netbox_clusters, vcvm2.cluster_name)
+    if netbox_cluster_id is None and vcvm2.cluster_name in created_clusters:
+        netbox_cluster_id = { "$ref": created_clusters[vcvm2.cluster_name] }
+        depends_on.append(created_clusters[vcvm2.cluster_name])
+
+    custom_fields = {}
+    custom_fields["vcenter_persistent_id"] = vcvm2.uuid
+    custom_fields["interface_sync_enabled"] = True
+
+    comment = ""
+    if vcvm2.comment is not None:
+        comment = vcvm2.comment
+
+    # Our company specific custom netbox attribute, if it's defined
+    if "SystemID" in vcvm2.custom_attributes:
+        custom_fields["SystemID"] = vcvm2.custom_attributes["SystemID"]
+
+    vm_change_id = plan.add(unit, "create", "virtual_machine", depends_on = depends_on, data = { "name": vcvm2.name,
+                                                                                                   "cluster": netbox_cluster_id,
+                                                                                                   "comments": comment,
+                                                                                                   "custom_fields": custom_fields,
+                                                                                                   "vcpus": vcvm2.vcpu,
+                                                                                                   "memory": vcvm2.memory_mb,
+                                                                                                   "disk": vcvm2.disk_gb })
+
+    # Create a new interface for each virtual nic for the VM in netbox, a new VM has no interfaces in netbox yet
+    vc_basevm = _get_basevm_from_vcenter_vm(vcvm2)
+    _plan_netbox_vm_interfaces(plan, unit, GenericVM( name = vcvm2.name, persistent_id = vcvm2.uuid, vcpu = None, memory_mb = None, disk_gb = None, comment = None ),
+                               vc_basevm, { "$ref": vm_change_id }, depends_on = [ vm_change_id ])
+
+    plan.add_unit(unit, "create", vcvm2.name, vcvm2.uuid)
+
+@profiled
+def _plan_netbox_vm_interfaces(plan, unit, netbox_vm, vcenter_vm, netbox_vm_id, depends_on = None):
+    # netbox_vm_id is either the id of the VM in netbox, or a reference to the change creating it (depends_on)
+    if depends_on is None:
+        depends_on = []
+
+    # Using the mac address as a unique id, to match the interfaces in netbox and vcenter
+    netbox_nics = { x.mac_address: x for x in netbox_vm.nics }
+    vcenter_macs = { x.mac_address for x in vcenter_vm.nics }
+
+    for nic in vcenter_vm.nics:
+        netbox_nic = netbox_nics.get(nic.mac_address)
+        if netbox_nic is not None:
+            # We have a interface with this mac address, check what has changed, if anything
+            data = {}
+            if nic.name != netbox_nic.name:
+                vm_logger.info("Found nic change, VC VM nic name: %s, NB VM nic name: %s", nic.name, netbox_nic.name)
+                data["name"] = nic.name
+            if nic.connected != netbox_nic.connected:
+                vm_logger.info("Found nic change, VC VM nic connected: %s, NB VM nic connected: %s", nic.connected, netbox_nic.connected)
+                data["enabled"] = nic.connected
+
+            if data:
+                plan.add(unit, "update", "interface", target = netbox_nic.netbox_id, data = data)
+
+            for ip in nic.ip_addresses:
+                if ip in netbox_nic.ip_addresses:
+                    vm_logger.info("Found IP address: %s in Netbox for VM: %s, on nic with mac address: %s", ip, vcenter_vm.name, nic.mac_address)
+                else:
+                    vm_logger.info("Did NOT find IP address: %s in Netbox for VM: %s, on nic with mac address: %s", ip, vcenter_vm.name, nic.mac_address)
+                    _plan_netbox_ip_assignment(plan, unit, vcenter_vm, nic, ip, netbox_nic.netbox_id, depends_on)
+        else:
+            vm_logger.info("Did not find an interface with mac addr: %s, with interface name: %s for VM: %s in Netbox, adding the interface", nic.mac_address, nic.name, vcenter_vm.name)
+
+            interface_change_id = plan.add(unit, "create", "interface", depends_on = depends_on, data = { "name": nic.name,
+                                                                                                          "type": "virtual",
+                                                                                                          "enabled": nic.connected,
+                                                                                                          "mac_address": nic.mac_address,
+                                                                                                          "virtual_machine": netbox_vm_id })
+
+            # We dont create new IP addresses that are not already present in netbox, as it should be the source of truth
+            for ip in nic.ip_addresses:
+                _plan_netbox_ip_assignment(plan, unit, vcenter_vm, nic, ip, { "$ref": interface_change_id }, [ interface_change_id ])
+
+    for nic2 in netbox_vm.nics:
+        # Check if netbox has interfaces not in vcenter
+        if nic2.mac_address in vcenter_macs:
+            vm_logger.info("NIC with mac address: %s exists in both Netbox and vcenter, nothing to do", nic2.mac_address)
+        elif nic2.mac_address is None or nic2.mac_address == "NONE":
+            vm_logger.warn("We can not safely delete this unused interface for VM: %s since the Netbox object has no mac address", vcenter_vm.name)
+        else:
+            vm_logger.info("NIC with mac address: %s does not exist in vcenter for the VM, removing it from the VM", nic2.mac_address)
+            plan.add(unit, "delete", "interface", target = nic2.netbox_id)
+
+def _plan_netbox_ip_assignment(plan, unit, vcenter_vm, nic, ip, interface_id, depends_on):
+    netbox_ips = netbox_ip_addresses_by_address.get(ip, [])
+    if len(netbox_ips) == 0:
+        vm_logger.info("Could not find IP address: %s in Netbox", ip)
+    elif len(netbox_ips) > 1:
+        vm_logger.warn("Found %s IP addresses: %s in Netbox, can not tell which one to add to VM: %s", len(netbox_ips), ip, vcenter_vm.name)
+    else:
+        vm_logger.info("VM: %s, will add ip: %s to nic with mac address: %s", vcenter_vm.name, ip, nic.mac_address)
+        plan.add(unit, "assign_ip", "ip_address", target = netbox_ips[0].id, depends_on = depends_on, data = { "interface": interface_id })
+
+def apply_plan(plan, concurrency, batch_size):
+    # Units completed by the run we are resuming are skipped, the rest of the plan is recorded in the
+    # journal as the in flight change set, before anything is written to netbox
+    skipped = [ x for x in plan.units if journal.is_done(x) ]
+    if skipped:
+        logger.info("Skipping %s clusters/VMs, completed by the interrupted run", len(skipped))
+
+    changes_by_unit = collections.defaultdict(list)
+    for change in plan.changes:
+        if not journal.is_done(change["unit"]):
+            changes_by_unit[change["unit"]].append(change)
+
+    for unit, changes in changes_by_unit.items():
+        journal.record_changes(unit, changes)
+
+    applier = PlanApplier(plan, changes_by_unit, concurrency, batch_size)
+    applier.run()
+
+def _netbox_endpoint(object_type):
+    return { "cluster": netbox_client.virtualization.clusters,
+             "virtual_machine": netbox_client.virtualization.virtual_machines,
+             "interface": netbox_client.virtualization.interfaces,
+             "ip_address": netbox_client.ipam.ip_addresses }[object_type]
+
+@profiled
+def _get_basevm_from_netbox_vm(netbox_vm):
+    nics = []
+    for netbox_interface in netbox_interfaces_by_vm.get(netbox_vm.raw_netbox_api_record.id, []):
+        ip_addresses = list(netbox_ip_addresses_by_interface.get(netbox_interface.raw_netbox_api_record.id, []))
+
+        nics.append( GenericNetworkInterface( name = netbox_interface.raw_netbox_api_record.name,
+                                              connected = netbox_interface.raw_netbox_api_record.enabled,
+                                              mac_address = netbox_interface.raw_netbox_api_record.mac_address,
+                                              ip_addresses = ip_addresses,
+                                              netbox_id = netbox_interface.raw_netbox_api_record.id ) )
+
+    valid_fields = netbox_custom_fields
+    custom_fields = []
+
+    for field in netbox_vm.raw_netbox_api_record.custom_fields:
+        if any(str(x['netbox_fieldname']).upper() == str(field).upper() for x in valid_fields):
+            custom_fields.append( { field : netbox_vm.raw_netbox_api_record.custom_fields.get(field) } )
+
+    if netbox_vm.raw_netbox_api_record.custom_fields.get('interface_sync_enabled') is not None:
+        interface_sync_enabled = netbox_vm.raw_netbox_api_record.custom_fields.get('interface_sync_enabled')
+    else:
+        interface_sync_enabled = None
+
+    base_vm = GenericVM( name = netbox_vm.name, 
+                         persistent_id = netbox_vm.vcenter_persistent_id,
+                         vcpu = netbox_vm.raw_netbox_api_record.vcpus,
+                         memory_mb = netbox_vm.raw_netbox_api_record.memory,
+                         disk_gb = netbox_vm.raw_netbox_api_record.disk,
+                         comment = netbox_vm.raw_netbox_api_record.comments,
+                         nics = nics,
+                         custom_fields = custom_fields,
+                         interface_sync_enabled = interface_sync_enabled)
+
+    return base_vm
+
+@profiled
+def _get_basevm_from_vcenter_vm(vcenter_vm):
+    nics = []
+    for nic in vcenter_vm.nics:
+        ip_addresses = []
+        if "ipAddresses" in nic:
+            for ip in nic["ipAddresses"]:
+                # Exclude IPv6 link local addresses
+                if ip.version == 6 and ip.is_link_local == True:
+                    continue
+                else:
+                    ip_addresses.append( str(ip) )
+
+        nics.append( GenericNetworkInterface( name = nic['label'],
+                                              connected = nic['connected'],
+                                              mac_address = nic['macAddress'],
+                                              ip_addresses = ip_addresses ) )
+
+    valid_fields = netbox_custom_fields
+    custom_fields = []
+
+    for field in vcenter_vm.custom_attributes:
+        if any(str(x['vcenter_custom_attribute']).upper() == str(field).upper() for x in valid_fields):
+            custom_fields.append( { field : vcenter_vm.custom_attributes.get(field) } )
+        else:
+            vm_logger.debug("Did not find a mapping for vcenter custom attribute: %s, skipping it", field)
+
+    base_vm = GenericVM( name = vcenter_vm.name, 
+                         persistent_id = vcenter_vm.uuid,
+                         vcpu = vcenter_vm.vcpu, 
+                         memory_mb = vcenter_vm.memory_mb,
+                         disk_gb = vcenter_vm.disk_gb,
+                         comment = vcenter_vm.comment,
+                         nics = nics,
+                         custom_fields = custom_fields )
+
+    return base_vm
+
+@profiled
+def get_vcenter_vms():
+    global vcenter_vms
+
+    from pyVmomi import vim
+
+    vmsView = vcenter_content.viewManager.CreateContainerView( vcenter_content.rootFolder, [vim.VirtualMachine], True )
+
+    vm_properties = [ "name", "config.instanceUuid", "summary.config.numCpu", "summary.config.memorySizeMB",
+                      "config.annotation", "config.template", "runtime.powerState", "guest.toolsRunningStatus",
+                      "guest.ipAddress", "summary.runtime.host", "availableField", "customValue", "config.hardware.device",
+                      "guest.net" ]
+    
+    vm_data = _get_vcenter_vms(container_view=vmsView, vm_properties=vm_properties)
+
+    for vm in vm_data:
+        vm_started = time.perf_counter()
+        vm_logger.info("Gathering information about VM: %s", vm['name'])
+        # instanceUuid is only unique per vcenter, we need to combine it with the vcenter uuid 
+        # if we want to be supporting multiple vcenters, currently we dont.
+
+        uuid = vm["config.instanceUuid"]
+        vcpus = vm["summary.config.numCpu"]
+        memory_mb = vm["summary.config.memorySizeMB"]
+        comment = vm.get("config.annotation") or "" # Might not exist
+        comment = comment.rstrip()
+        is_template = vm["config.template"]
+        power_state = str(vm["runtime.powerState"]) # Plain string, so the inventory snapshot can be pickled
+        vmtools_status = vm["guest.toolsRunningStatus"]
+        
+        disk_size_gb = 0
+        vm_nics = []
+        for device in vm["config.hardware.device"]:
+             if isinstance(device, vim.vm.device.VirtualDisk):
+                disk_size_gb += (device.capacityInKB / 1024 / 1024)
+             elif isinstance(device, vim.vm.device.VirtualEthernetCard):
+                device_info = {}
+                device_info["macAddress"] = device.macAddress
+                device_info["label"] = device.deviceInfo.label
+                device_info["connected"] = device.connectable.connected
+                vm_nics.append( device_info )
+        
+        # If VMware tools are running, try to get the IPs reported back from the VMware tools
+        # This is really buggy territory, even if VMware tools are running, they could return 
+        # anything from nothing to wrong IPs, or anything else really depending on the version/os installed.
+        # Some Linux versions of the VMware tools seems really bad (returning the same ips for all nics / 
+        # interfaces present on the VM)
+        if vmtools_status == "guestToolsRunning":
+            vm_logger.info("VM: %s - VMware Tools running, trying to get IPs reported back", vm['name'])
+
+            for nic1 in vm["guest.net"]:
+                for nic2 in vm_nics:
+                    if nic2["macAddress"] == nic1.macAddress:
+                        interface_addresses = []
+                        if nic1.ipConfig is not None: # Might return nothing even if vmware tools are running
+                            for addr in nic1.ipConfig.ipAddress:
+                                vm_logger.debug("VM: %s, nic: %s, mac: %s", vm['name'], addr.ipAddress, nic1.macAddress)
+                                ip_address = ipaddress.ip_interface(f"{ addr.ipAddress }/{ addr.prefixLength }" )
+                                interface_addresses.append(ip_address)
+                            
+                            nic2["ipAddresses"] = interface_addresses
+        
+        # The API for getting _all_ ips are broken, the limit seems to be around 4 IP addresses are being returned
+        # So for now, just take whatever IP is listed as the default, and figure out a way to fix it later on
+        # This might be somewhat related to the vmtools version installed, needs further investigation
+        primary_ipaddress = vm.get("guest.ipAddress") or "" # Might not exist
+
+        vm_logger.debug("uuid: %s, vcpus: %s, memory: %s, comment: %s, is_template: %s, power_state: %s, vmtools_status: %s, primary_ip: %s, disksize: %s", uuid, vcpus, memory_mb, comment, is_template, power_state, vmtools_status, primary_ipaddress, disk_size_gb)
+        
+        custom_attributes = {}
+        vm_availablefield = vm["availableField"]
+        for x in vm["customValue"]:
+            fieldname = _vcenter_get_customfield_fieldname(vm_availablefield, x)
+            custom_attributes[fieldname] = x.value
+        
+        cluster_name = _vcenter_get_clustername(vm['summary.runtime.host']._moId)
+
+        vcenter_vms.append( VMwareVM( name = vm['name'],
+                                      uuid = uuid,
+                                      vcpu = vcpus,
+                                      memory_mb = memory_mb,
+                                      disk_gb = disk_size_gb,
+                                      comment = comment,
+                                      power_state = power_state,
+                                      vmtools_status = vmtools_status,
+                                      nics = vm_nics,
+                                      primary_ipaddress = primary_ipaddress,
+                                      is_template = is_template,
+                                      custom_attributes = custom_attributes,
+                                      cluster_name = cluster_name ) )
+
+        profile_slow_vm("get_vcenter_vms", vm['name'], vm_started)
+
+def _get_vcenter_vms(container_view, vm_properties):
+    from pyVmomi import vim
+    from pyVmomi import vmodl
+  
+    object_spec = vmodl.query.PropertyCollector.ObjectSpec( obj = container_view,
+                                                            skip = True)
+
+    traversal_spec = vmodl.query.PropertyCollector.TraversalSpec( name = 'traverseEntities',
+                                                                  path = 'view',
+                                                                  skip = False,
+                                                                  type = container_view.__class__ )
+
+    object_spec.selectSet = [traversal_spec]
+
+    property_spec = vmodl.query.PropertyCollector.PropertySpec( type = vim.VirtualMachine,
+                                                                pathSet = vm_properties )
+
+    filter_spec = vmodl.query.PropertyCollector.FilterSpec( objectSet = [object_spec],
+                                                            propSet = [property_spec] )
+
+    vm_properties = vcenter_content.propertyCollector.RetrieveContents([filter_spec])
+
+    vm_data = []
+    for vm_property in vm_properties:
+        properties = {}
+        for prop in vm_property.propSet:
+            properties[prop.name] = prop.val
+            properties['obj'] = vm_property.obj
+
+        vm_data.append(properties)
+    return vm_data
+
+@functools.lru_cache(maxsize=32)
+def _vcenter_get_clustername(host):
+    for cluster in vcenter_clusters:
+        for cluster_host in cluster.hosts:
+            if cluster_host.endswith(host):
+                return cluster.name
+
+    return None
+
+def _netbox_get_cluster_id(netbox_clusters, vcenter_cluster_name):
+    for cluster in netbox_clusters:
+        if cluster.raw_netbox_api_record.name == vcenter_cluster_name:
+            return cluster.raw_netbox_api_record.id
+
+def _vcenter_get_customfield_fieldname(available_fields, custom_field):
+    for x in available_fields:
+        if x.key == custom_field.key:
+            return x.name
+
+def get_netbox_vms(nb_vms = None):
+    global netbox_vms
+
+    # The records are passed in when they are read from the netbox mirror, see load_netbox_mirror()
+    if nb_vms is None:
+        try:
+            nb_vms = netbox_client.virtualization.virtual_machines.all()
+        except Exception as ex: 
+            logger.error("Failed getting a list of netbox vms")
+            logger.exception(ex)
+            raise SystemExit(-1)
+    
+    for nb_vm in nb_vms:
+        netbox_vms.append( NetboxVM( name = nb_vm.name,
+                                     vcenter_persistent_id = nb_vm.custom_fields.get('vcenter_persistent_id'),
+                                     raw_netbox_api_record = nb_vm ) )
+
+def debug_print_object_info(obj):
+    print(">x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>")
+    for attr in dir(obj):
+        print("obj.%s = %r" % (attr, getattr(obj, attr)))
+    print("<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<")
+
+def debug_print_netbox_object(obj):
+    from pprint import pprint
+
+    print(">x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>x>")
+    pprint(dict(obj))
+    print("<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<z<")
+
+def reset_run_state():
+    # A run keeps what it collects in the module globals above, they are reset at the start of main(),
+    # so it can be called more than once in the same process, without mixing up the runs
+    global vcenter_session
+    global vcenter_content
+    global netbox_client
+    global journal
+    global retry_queue_passes
+    global retry_backoff
+    global profile_enabled
+    global profiler
+    global profile_last_snapshot
+    global profile_last_phase_time
+
+    vcenter_session = None
+    vcenter_content = None
+    netbox_client = None
+    journal = None
+    retry_queue_passes = 3
+    retry_backoff = 0.5
+    profile_enabled = False
+    profiler = None
+    profile_last_snapshot = None
+    profile_last_phase_time = None
+
+    for inventory in [ vcenter_vms, vcenter_clusters, netbox_vms, netbox_clusters, netbox_interfaces,
+                       netbox_interfaces_by_vm, netbox_ip_addresses_by_address, netbox_ip_addresses_by_interface,
+                       retry_queue, profile_function_timings ]:
+        inventory.clear()
+
+    get_vcenter_clusters.cache_clear()
+    _vcenter_get_clustername.cache_clear()
+
+def initialize_vcenter_connection():
+    global vcenter_session
+    global vcenter_content
+
+    from pyVim import connect
+
+    vcenter_hostname = os.environ.get("VCENTER_HOSTNAME")
+    vcenter_username = os.environ.get("VCENTER_USERNAME")
+    vcenter_password = os.environ.get("VCENTER_PASSWORD")
+
+    if not vcenter_hostname or not vcenter_username or not vcenter_password:
+        logger.error("vCenter hostname/username/password is not set via environment variables")
+        raise SystemExit(-1)
+
+    vcenter_session = connect.SmartConnectNoSSL( host=vcenter_hostname,
+                                                 user=vcenter_username,
+                                                 pwd=vcenter_password,
+                                                 port=int(443) )
+
+    atexit.register(connect.Disconnect, vcenter_session)
+
+    vcenter_content = vcenter_session.RetrieveContent()
+
+def initialize_netbox_client(args):
+    global netbox_client
+    global retry_queue_passes
+    global retry_backoff
+
+    import pynetbox
+    import requests
+    import urllib3
+    from urllib3.util.retry import Retry
+    from netbox_sync.retry import JitteredRetry, TimeoutHTTPAdapter
+
+    netbox_url = os.environ.get("NETBOX_API_URI")
+    netbox_token = os.environ.get("NETBOX_API_TOKEN")
+
+    if not netbox_url or not netbox_token:
+        logger.error("Netbox url/token is not set via environment variables")
+        raise SystemExit(-1)
+
+    # Disable warnings about SSL
+    urllib3.disable_warnings()
+
+    # Certificates are not verified, see the session below
+    netbox_client = pynetbox.api (
+        url = netbox_url,
+        token = netbox_token
+    )
+
+    retry_queue_passes = args.retry_passes
+    retry_backoff = args.retry_backoff
+
+    # Retry idempotent requests on connection errors and transient server errors. We also retry PATCH,
+    # since all our updates set absolute values, POST (creates) are left to the retry queue instead
+    retry = JitteredRetry( total = args.retries,
+                           backoff_factor = args.retry_backoff,
+                           status_forcelist = [ 429, 500, 502, 503, 504 ],
+                           allowed_methods = Retry.DEFAULT_ALLOWED_METHODS | { "PATCH" },
+                           respect_retry_after_header = True,
+                           raise_on_status = False )
+
+    # One shared session for all requests, with a keep-alive pool sized for the concurrency
+    adapter = TimeoutHTTPAdapter( pool_connections = 1,
+                                  pool_maxsize = args.concurrency,
+                                  pool_block = True,
+                                  max_retries = retry,
+                                  timeout = args.timeout )
+
+    session = requests.Session()
+    session.verify = False
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    netbox_client.http_session = session
+
+def initialize_logging(args):
+    global logger
+    global vm_logger
+    global log_listener
+
+    logger = logging.getLogger()
+    logger.setLevel(args.log_level)
+
+    # Replaces the handlers of a previous run in the same process, so lines aren't logged twice
+    if log_listener is not None:
+        log_listener.stop()
+        atexit.unregister(log_listener.stop)
+        for handler in log_listener.handlers:
+            handler.close()
+    for handler in [ x for x in logger.handlers if isinstance(x, BackgroundQueueHandler) ]:
+        logger.removeHandler(handler)
+
+    # Per VM details, with --log-mode compact only warnings and errors are logged from here,
+    # along with one summary line per changed VM, see log_vm_summary()
+    vm_logger = logging.getLogger("netbox-sync.vm")
+    if args.log_mode == "compact":
+        vm_logger.setLevel(logging.WARNING)
+    else:
+        vm_logger.setLevel(logging.NOTSET)
+
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.INFO)
+
+    fh = logging.FileHandler(args.log_file)
+    fh.setLevel(logging.DEBUG)
+    
+    if args.log_mode == "compact":
+        formatter = JsonLogFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(funcName)s - %(levelname)s - %(message)s')
+    ch.setFormatter(formatter)
+    fh.setFormatter(formatter)
+    
+    # The console/file handlers run on a background thread, so the sync doesn't wait on logging I/O
+    log_queue = queue.SimpleQueue()
+    log_listener = logging.handlers.QueueListener(log_queue, ch, fh, respect_handler_level=True)
+    log_listener.start()
+    atexit.register(log_listener.stop)
+
+    logger.addHandler(BackgroundQueueHandler(log_queue))
+    
+def initialize_journal(args):
+    global journal
+
+    journal = RunJournal(args.journal)
+
+    if args.resume:
+        if journal.load():
+            logger.info("Resuming the interrupted run, %s units already done, %s in flight", len(journal.completed), len(journal.in_flight))
+        else:
+            logger.info("No journal found at %s, nothing to resume, starting a new run", args.journal)
+    elif os.path.exists(args.journal):
+        logger.warn("The previous run was interrupted, starting over since --resume wasn't given")
+
+    journal.open(args.resume)
+
+def save_vcenter_snapshot(filename):
+    import pickle
+
+    # Written to a temporary file first, so an interrupted write doesn't leave a broken snapshot behind
+    try:
+        with open(filename + ".tmp", "wb") as f:
+            pickle.dump( { "created": time.time(), "clusters": vcenter_clusters, "vms": vcenter_vms }, f, protocol=pickle.HIGHEST_PROTOCOL )
+        os.replace(filename + ".tmp", filename)
+    except Exception as ex:
+        logger.warn("Failed saving the vcenter inventory snapshot")
+        logger.exception(ex)
+
+def load_vcenter_snapshot(filename, max_age):
+    # Returns True if a recent enough snapshot was loaded into vcenter_clusters/vcenter_vms
+    import pickle
+
+    if not os.path.exists(filename):
+        return False
+
+    try:
+        with open(filename, "rb") as f:
+            snapshot = pickle.load(f)
+    except Exception as ex:
+        logger.warn("Failed loading the vcenter inventory snapshot, getting the inventory from vcenter instead")
+        logger.exception(ex)
+        return False
+
+    age = time.time() - snapshot["created"]
+    if age > max_age:
+        logger.info("The vcenter inventory snapshot is %.0fs old (max: %ss), getting the inventory from vcenter instead", age, max_age)
+        return False
+
+    vcenter_clusters.extend(snapshot["clusters"])
+    vcenter_vms.extend(snapshot["vms"])
+    logger.info("Using the vcenter inventory snapshot from %.0fs ago, with %s clusters and %s VMs", age, len(vcenter_clusters), len(vcenter_vms))
+    return True
+
+def load_netbox_mirror(filename, max_age):
+    # Returns True if the netbox inventory was loaded from the mirror kept by webhook-listen. The mirror is only
+    # used while the listener keeps saving it, otherwise it might be missing changes made in netbox since
+    if not os.path.exists(filename):
+        logger.info("No netbox mirror found at %s, getting the inventory from netbox instead", filename)
+        return False
+
+    try:
+        mirror = NetboxMirror.load(filename)
+    except Exception as ex:
+        logger.warn("Failed loading the netbox mirror, getting the inventory from netbox instead")
+        logger.exception(ex)
+        return False
+
+    age = time.time() - mirror.updated_at
+    if age > max_age:
+        logger.warn("The netbox mirror was last saved %.0fs ago (max: %ss), is webhook-listen running? Getting the inventory from netbox instead", age, max_age)
+        return False
+
+    get_netbox_clusters(mirror.records("cluster"))
+    get_netbox_vms(mirror.records("virtual_machine"))
+    get_netbox_interfaces(mirror.records("interface"))
+    get_netbox_ip_addresses(mirror.records("ip_address"))
+    logger.info("Using the netbox mirror saved %.0fs ago, with %s clusters and %s VMs", age, len(netbox_clusters), len(netbox_vms))
+    return True
+
+def initialize_profiling(args):
+    global profile_enabled
+    global profile_slow_vm_threshold
+    global profile_output
+    global profiler
+    global profile_last_phase_time
+
+    if not args.profile:
+        return
+
+    import tracemalloc
+
+    profile_enabled = True
+    profile_slow_vm_threshold = args.profile_slow_vm_threshold
+    profile_output = args.profile_output
+    profile_last_phase_time = time.perf_counter()
+
+    tracemalloc.start(args.profile_traceback_depth)
+
+    profiler = SamplingProfiler(interval = args.profile_interval)
+    profiler.start()
+
+def finish_profiling():
+    if not profile_enabled:
+        return
+
+    import tracemalloc
+
+    profiler.stop()
+    profiler.write_folded(profile_output)
+    logger.info("Profile: wrote %s stack samples to %s", sum(profiler.samples.values()), profile_output)
+
+    for name, (calls, total) in sorted(profile_function_timings.items(), key=lambda x: x[1][1], reverse=True):
+        logger.info("Profile: %s called %s times, total: %.3fs, average: %.2fms", name, calls, total, total / calls * 1000)
+
+    tracemalloc.stop()
+
+def parse_arguments(argv = None):
+    parser = argparse.ArgumentParser(description="Update netbox with vSphere clusters and VMs")
+    parser.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                        help="Lowest level to log, DEBUG is expensive on large inventories (default: %(default)s)")
+    parser.add_argument("--log-mode", default="verbose", choices=["verbose", "compact"],
+                        help="compact logs one JSON line per changed VM, instead of several lines per VM (default: %(default)s)")
+    parser.add_argument("--log-file", default="netbox-sync.log",
+                        help="File to write the log to (default: %(default)s)")
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="Number of connections to keep open to netbox, and concurrent requests when applying changes (default: %(default)s)")
+    parser.add_argument("--batch-size", type=int, default=50,
+                        help="Number of objects to create/update/delete per bulk request, when applying changes (default: %(default)s)")
+    parser.add_argument("--timeout", type=float, default=30,
+                        help="Seconds to wait for netbox to accept a connection or send data, before the request fails (default: %(default)s)")
+    parser.add_argument("--retries", type=int, default=5,
+                        help="Number of times to retry a failed netbox request (default: %(default)s)")
+    parser.add_argument("--retry-backoff", type=float, default=0.5,
+                        help="Backoff factor in seconds between retries, doubled on every retry (default: %(default)s)")
+    parser.add_argument("--retry-passes", type=int, default=3,
+                        help="Number of passes over the failed netbox updates at the end of the run (default: %(default)s)")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue an interrupted run from the journal, skipping the clusters/VMs it already finished")
+    parser.add_argument("--journal", default="netbox-sync-journal.jsonl",
+                        help="File to checkpoint the progress of the run to (default: %(default)s)")
+    parser.add_argument("--snapshot", default="netbox-sync-vcenter.snapshot",
+                        help="File to save the vcenter inventory to, reused by --resume (default: %(default)s)")
+    parser.add_argument("--snapshot-max-age", type=int, default=3600,
+                        help="Seconds a vcenter inventory snapshot can be reused by --resume (default: %(default)s)")
+    parser.add_argument("--netbox-mirror",
+                        help="File with the netbox mirror kept by webhook-listen, sync/plan reads netbox from it, if it is up to date")
+    parser.add_argument("--netbox-mirror-max-age", type=int, default=300,
+                        help="Seconds since webhook-listen last saved the mirror, before sync/plan fetches from netbox instead (default: %(default)s)")
+    parser.add_argument("--profile", action="store_true",
+                        help="Enable the sampling profiler, tracemalloc snapshots at each phase, and slow VM logging")
+    parser.add_argument("--profile-output", default="netbox-sync-profile.folded",
+                        help="File to write the folded stack samples to, can be used with flamegraph.pl or speedscope (default: %(default)s)")
+    parser.add_argument("--profile-interval", type=float, default=0.005,
+                        help="Seconds between stack samples (default: %(default)s)")
+    parser.add_argument("--profile-slow-vm-threshold", type=float, default=2.0,
+                        help="Log VMs taking longer than this many seconds in a single phase (default: %(default)s)")
+    parser.add_argument("--profile-traceback-depth", type=int, default=1,
+                        help="Number of frames tracemalloc stores per allocation (default: %(default)s)")
+
+    subparsers = parser.add_subparsers(dest="command", metavar="command",
+                                       help="What to do, the options above goes before the command (default: sync)")
+    subparsers.add_parser("sync", help="Plan the changes needed in netbox, and apply them right away")
+    plan_parser = subparsers.add_parser("plan", help="Plan the changes needed in netbox, and save the plan to a file, without changing anything")
+    plan_parser.add_argument("-o", "--output", default="netbox-sync-plan.json",
+                             help="File to save the plan to (default: %(default)s)")
+    apply_parser = subparsers.add_parser("apply", help="Apply a plan saved by the plan command")
+    apply_parser.add_argument("plan_file", help="The plan to apply")
+    show_plan_parser = subparsers.add_parser("show-plan", help="Show the changes in a plan saved by the plan command")
+    show_plan_parser.add_argument("plan_file", help="The plan to show")
+    subparsers.add_parser("validate-config", help="Check the vcenter/netbox settings in the environment, without connecting to them")
+    listen_parser = subparsers.add_parser("webhook-listen", help="Receive netbox webhooks, and keep the netbox mirror (--netbox-mirror) up to date")
+    listen_parser.add_argument("--listen-address",
+                               help="Address to listen for webhooks on (default: 0.0.0.0, or 127.0.0.1 if NETBOX_WEBHOOK_SECRET isn't set)")
+    listen_parser.add_argument("--listen-port", type=int, default=8080,
+                               help="Port to listen for webhooks on (default: %(default)s)")
+    listen_parser.add_argument("--mirror-flush-interval", type=float, default=5,
+                               help="Seconds between saving the changes received to the mirror (default: %(default)s)")
+    listen_parser.add_argument("--mirror-refresh-interval", type=int, default=86400,
+                               help="Seconds between fetching everything from netbox again, to catch up on missed webhooks, 0 to disable (default: %(default)s)")
+
+    args = parser.parse_args(argv)
+    if args.command is None:
+        args.command = "sync"
+
+    return args
+
+def get_inventory(args):
+    # Netbox is fetched, since it is what we are changing, unless it can be read from an up to date mirror.
+    # When resuming an interrupted run, the vcenter inventory can be reused from the snapshot, if it is recent enough
+    if not (args.resume and load_vcenter_snapshot(args.snapshot, args.snapshot_max_age)):
+        initialize_vcenter_connection()
+        profile_phase("initialize")
+
+        get_vcenter_clusters()
+        profile_phase("get_vcenter_clusters")
+        get_vcenter_vms()
+        profile_phase("get_vcenter_vms")
+        save_vcenter_snapshot(args.snapshot)
+
+    if args.netbox_mirror and load_netbox_mirror(args.netbox_mirror, args.netbox_mirror_max_age):
+        profile_phase("load_netbox_mirror")
+        return
+
+    get_netbox_clusters()
+    profile_phase("get_netbox_clusters")
+    get_netbox_vms()
+    profile_phase("get_netbox_vms")
+    get_netbox_interfaces()
+    profile_phase("get_netbox_interfaces")
+    get_netbox_ip_addresses()
+    profile_phase("get_netbox_ip_addresses")
+
+def print_plan(plan):
+    print(f"Plan created: {time.ctime(plan.created)}, {len(plan.changes)} changes for {len(plan.units)} clusters/VMs")
+    for (action, object_type), count in sorted(collections.Counter( (x["action"], x["object"]) for x in plan.changes ).items()):
+        print(f"  {action} {object_type}: {count}")
+
+    changes_by_unit = collections.defaultdict(list)
+    for change in plan.changes:
+        changes_by_unit[change["unit"]].append(change)
+
+    for key, unit in plan.units.items():
+        print()
+        print(f"{unit['action']}: {unit['name']} ({key})")
+        for change in changes_by_unit[key]:
+            target = f" {change['target']}" if change["target"] is not None else ""
+            depends_on = f", after change(s): {', '.join(str(x) for x in change['depends_on'])}" if change["depends_on"] else ""
+            print(f"  [{change['id']}] {change['action']} {change['object']}{target}: {json.dumps(change['data'], default=str)}{depends_on}")
+
+def run_sync(args):
+    initialize_journal(args)
+    initialize_netbox_client(args)
+    get_inventory(args)
+
+    plan = plan_netbox_changes()
+    profile_phase("plan_netbox_changes")
+
+    apply_plan(plan, args.concurrency, args.batch_size)
+    profile_phase("apply_plan")
+    drain_retry_queue()
+    profile_phase("drain_retry_queue")
+
+    journal.finish()
+
+def run_plan(args):
+    initialize_netbox_client(args)
+    get_inventory(args)
+
+    plan = plan_netbox_changes()
+    profile_phase("plan_netbox_changes")
+
+    plan.save(args.output)
+    logger.info("Saved the plan to %s", args.output)
+
+def run_apply(args):
+    plan = ChangePlan.load(args.plan_file)
+
+    initialize_journal(args)
+    initialize_netbox_client(args)
+
+    apply_plan(plan, args.concurrency, args.batch_size)
+    profile_phase("apply_plan")
+    drain_retry_queue()
+    profile_phase("drain_retry_queue")
+
+    journal.finish()
+
+def run_webhook_listen(args):
+    from netbox_sync.webhook import WebhookServer
+
+    if not args.netbox_mirror:
+        logger.error("webhook-listen needs --netbox-mirror, the file to keep the mirror in")
+        raise SystemExit(-1)
+
+    # The mirror decides what is changed/deleted in netbox, so without a secret to check the webhooks
+    # against, we only listen on localhost, unless told otherwise
+    secret = os.environ.get("NETBOX_WEBHOOK_SECRET")
+    listen_address = args.listen_address
+    if not secret:
+        secret = None
+        if listen_address is None:
+            listen_address = "127.0.0.1"
+            logger.warn("NETBOX_WEBHOOK_SECRET is not set, the signature of the webhooks will not be checked, only listening on %s", listen_address)
+        else:
+            logger.warn("NETBOX_WEBHOOK_SECRET is not set, the signature of the webhooks will not be checked, anyone who can reach %s can change the mirror", listen_address)
+    elif listen_address is None:
+        listen_address = "0.0.0.0"
+
+    initialize_netbox_client(args)
+
+    # Listen before seeding, so changes made in netbox while we are fetching are not missed
+    mirror = NetboxMirror(args.netbox_mirror)
+    server = WebhookServer( (listen_address, args.listen_port), mirror, secret )
+    server_thread = threading.Thread(target=server.serve_forever, name="webhook-listener", daemon=True)
+    server_thread.start()
+    logger.info("Listening for netbox webhooks on %s:%s", listen_address, args.listen_port)
+
+    mirror.seed()
+    mirror.save()
+
+    # Stopped with SIGTERM (or ctrl-c), the mirror is saved before exiting
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        while True:
+            time.sleep(args.mirror_flush_interval)
+
+            try:
+                if args.mirror_refresh_interval and time.time() - mirror.seeded_at >= args.mirror_refresh_interval:
+                    # Catches up on webhooks netbox failed to deliver
+                    mirror.seed()
+                if mirror.dirty or time.time() - mirror.updated_at >= mirror.heartbeat_interval:
+                    mirror.save()
+            except Exception as ex:
+                logger.warn("Failed refreshing/saving the netbox mirror, trying again in %ss", args.mirror_flush_interval)
+                logger.exception(ex)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        mirror.save()
+        logger.info("Stopped listening for netbox webhooks, saved the netbox mirror to %s", args.netbox_mirror)
+
+def validate_config():
+    problems = []
+
+    for name in [ "VCENTER_HOSTNAME", "VCENTER_USERNAME", "VCENTER_PASSWORD", "NETBOX_API_URI", "NETBOX_API_TOKEN" ]:
+        if not os.environ.get(name):
+            problems.append(f"{name} is not set")
+
+    netbox_url = os.environ.get("NETBOX_API_URI")
+    if netbox_url and not netbox_url.startswith(("http://", "https://")):
+        problems.append(f"NETBOX_API_URI: {netbox_url} is not a http:// or https:// url")
+
+    for field in netbox_custom_fields:
+        if not field.get("netbox_fieldname") or not field.get("vcenter_custom_attribute"):
+            problems.append(f"netbox_custom_fields entry: {field} needs both a netbox_fieldname and a vcenter_custom_attribute")
+
+    if not os.environ.get("NETBOX_WEBHOOK_SECRET"):
+        print("NETBOX_WEBHOOK_SECRET is not set, webhook-listen will not check the signature of the webhooks, and only listens on 127.0.0.1 by default")
+
+    for problem in problems:
+        print(problem)
+    if problems:
+        raise SystemExit(-1)
+
+    print("The configuration looks OK")
+
+def main(argv = None):
+    args = parse_arguments(argv)
+    reset_run_state()
+
+    # These don't talk to vcenter/netbox, so they skip the logging setup as well
+    if args.command == "show-plan":
+        print_plan(ChangePlan.load(args.plan_file))
+        return
+    if args.command == "validate-config":
+        validate_config()
+        return
+
+    initialize_logging(args)
+    initialize_profiling(args)
+
+    # Runs that fail are the ones most worth profiling, so the profile is written either way
+    try:
+        if args.command == "plan":
+            run_plan(args)
+        elif args.command == "apply":
+            run_apply(args)
+        elif args.command == "webhook-listen":
+            run_webhook_listen(args)
+        else:
+            run_sync(args)
+    finally:
+        finish_profiling()
+
+if __name__ == "__main__":
+    main()
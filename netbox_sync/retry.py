@@ -0,0 +1,25 @@
+import random
+
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Kept out of netbox_sync.cli, so requests/urllib3 are only imported when connecting to netbox
+
+class JitteredRetry(Retry):
+    # Adds jitter to the exponential backoff, so concurrent requests that failed at
+    # the same time (e.g. during a netbox restart) doesn't all retry at the same time
+    def get_backoff_time(self):
+        backoff = super().get_backoff_time()
+        return backoff / 2 + random.uniform(0, backoff / 2)
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    # requests waits forever by default, and pynetbox doesn't pass a timeout, so a netbox
+    # that stops responding would hang the run (and hold one of the pooled connections)
+    def __init__(self, *args, timeout = None, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
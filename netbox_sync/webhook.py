@@ -0,0 +1,60 @@
+import hashlib
+import hmac
+import http.server
+import json
+import logging
+
+# Kept out of netbox_sync.cli, so http.server is only imported by the webhook-listen command
+
+logger = logging.getLogger()
+
+class WebhookHandler(http.server.BaseHTTPRequestHandler):
+    # Receives the netbox webhooks, and applies them to the mirror of the server (WebhookServer)
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        # Netbox signs the body with the secret of the webhook, as a hex HMAC-SHA512 digest
+        if self.server.secret is not None:
+            signature = hmac.new(self.server.secret.encode("utf-8"), body, hashlib.sha512).hexdigest()
+            if not hmac.compare_digest(signature, self.headers.get("X-Hook-Signature", "")):
+                logger.warn("Ignoring a webhook from %s with an invalid signature", self.client_address[0])
+                self.send_response(403)
+                self.end_headers()
+                return
+
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            payload = None
+
+        # Netbox always sends a JSON object, with the event, model and data
+        if not isinstance(payload, dict):
+            self.send_response(400)
+            self.end_headers()
+            return
+
+        if self.server.mirror.apply_event(payload):
+            logger.debug("Applied %s %s id: %s to the netbox mirror", payload.get("event"), payload.get("model"), payload["data"]["id"])
+
+        self.send_response(204)
+        self.end_headers()
+
+    def do_GET(self):
+        # Health check for monitoring the listener
+        body = json.dumps(self.server.mirror.status()).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("Webhook request from %s: " + format, self.client_address[0], *args)
+
+class WebhookServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, mirror, secret):
+        super().__init__(address, WebhookHandler)
+        self.mirror = mirror
+        self.secret = secret
@@ -0,0 +1,72 @@
+import json
+import logging
+
+from netbox_sync import cli
+
+
+def write_journal(filename, entries, tail = ""):
+    with open(filename, "w") as f:
+        for entry in entries:
+            f.write(json.dumps(entry) + "\n")
+        f.write(tail)
+
+
+def test_load_stops_at_a_truncated_last_line(tmp_path):
+    filename = str(tmp_path / "journal.jsonl")
+    write_journal(filename, [ { "run": { "started": 0 } },
+                              { "in_flight": "netbox_vm:1", "changes": [] },
+                              { "done": "netbox_vm:1" },
+                              { "in_flight": "netbox_vm:2", "changes": [ { "id": 2 } ] } ],
+                  tail = '{ "done": "netbox_v')
+
+    journal = cli.RunJournal(filename)
+
+    assert journal.load()
+    assert journal.completed == { "netbox_vm:1" }
+    assert journal.in_flight == { "netbox_vm:2": [ { "id": 2 } ] }
+
+
+def test_load_without_a_journal(tmp_path):
+    assert not cli.RunJournal(str(tmp_path / "journal.jsonl")).load()
+
+
+def test_resume_skips_the_completed_units(tmp_path, monkeypatch):
+    filename = str(tmp_path / "journal.jsonl")
+    write_journal(filename, [ { "run": { "started": 0 } },
+                              { "in_flight": "netbox_vm:1", "changes": [] },
+                              { "done": "netbox_vm:1" },
+                              { "in_flight": "netbox_vm:2", "changes": [] } ])
+
+    journal = cli.RunJournal(filename)
+    journal.load()
+    journal.open(resume = True)
+    monkeypatch.setattr(cli, "journal", journal)
+    monkeypatch.setattr(cli, "logger", logging.getLogger())
+
+    plan = cli.ChangePlan()
+    for vm_id in [ 1, 2, 3 ]:
+        plan.add(f"netbox_vm:{vm_id}", "update", "virtual_machine", target = vm_id, data = { "vcpus": 2 })
+        plan.add_unit(f"netbox_vm:{vm_id}", "update", f"vm{vm_id}", f"u{vm_id}")
+
+    applied = []
+    monkeypatch.setattr(cli.PlanApplier, "run", lambda self: applied.extend(self.changes))
+    cli.apply_plan(plan, concurrency = 1, batch_size = 50)
+
+    assert [ x["unit"] for x in applied ] == [ "netbox_vm:2", "netbox_vm:3" ]
+
+    # The changes of the units still to do are recorded as in flight, for the next resume
+    resumed = cli.RunJournal(filename)
+    resumed.load()
+    assert resumed.completed == { "netbox_vm:1" }
+    assert set(resumed.in_flight) == { "netbox_vm:2", "netbox_vm:3" }
+
+
+def test_finish_removes_the_journal(tmp_path):
+    filename = tmp_path / "journal.jsonl"
+    journal = cli.RunJournal(str(filename))
+    journal.open(resume = False)
+    journal.done("netbox_vm:1")
+
+    journal.finish()
+
+    assert not filename.exists()
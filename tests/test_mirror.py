@@ -0,0 +1,125 @@
+import hashlib
+import hmac
+import json
+import logging
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from netbox_sync import cli
+from netbox_sync.webhook import WebhookServer
+
+
+def event(action, object_id, last_updated, model = "virtualmachine", **data):
+    return { "event": action, "model": model, "data": dict(data, id = object_id, last_updated = last_updated) }
+
+
+def test_older_updates_are_ignored():
+    mirror = cli.NetboxMirror("mirror.json")
+
+    assert mirror.apply_event(event("created", 1, "2024-01-01T00:00:01Z", name = "vm1"))
+    assert mirror.apply_event(event("updated", 1, "2024-01-01T00:00:03Z", name = "vm2"))
+    assert not mirror.apply_event(event("updated", 1, "2024-01-01T00:00:02Z", name = "vm3"))
+
+    assert mirror.objects["virtual_machine"]["1"]["name"] == "vm2"
+
+
+def test_late_updates_dont_bring_back_deleted_objects():
+    mirror = cli.NetboxMirror("mirror.json")
+    mirror.apply_event(event("created", 1, "2024-01-01T00:00:01Z"))
+
+    assert mirror.apply_event(event("deleted", 1, "2024-01-01T00:00:02Z"))
+    assert not mirror.apply_event(event("updated", 1, "2024-01-01T00:00:02Z"))
+    assert not mirror.apply_event(event("updated", 1, "2024-01-01T00:00:01Z"))
+
+    assert "1" not in mirror.objects["virtual_machine"]
+
+
+def test_delete_during_a_seed(monkeypatch):
+    # The VM is fetched by the seed, and deleted in netbox before the seed is done
+    mirror = cli.NetboxMirror("mirror.json")
+    mirror.apply_event(event("created", 1, "2024-01-01T00:00:01Z"))
+    mirror.seeded_at = time.time()
+
+    class Endpoint:
+        def __init__(self, records):
+            self.records = records
+
+        def all(self):
+            if self.records:
+                mirror.apply_event(event("deleted", 1, "2024-01-01T00:00:01Z"))
+            return self.records
+
+    class Record(dict):
+        id = 1
+
+    vm = Record(id = 1, last_updated = "2024-01-01T00:00:01Z")
+    monkeypatch.setattr(cli, "logger", logging.getLogger())
+    monkeypatch.setattr(cli, "_netbox_endpoint", lambda object_type: Endpoint([ vm ] if object_type == "virtual_machine" else []))
+    mirror.seed()
+
+    assert mirror.objects["virtual_machine"] == {}
+    assert not mirror.apply_event(event("updated", 1, "2024-01-01T00:00:01Z"))
+
+
+def test_delete_delivered_before_the_create():
+    mirror = cli.NetboxMirror("mirror.json")
+
+    mirror.apply_event(event("deleted", 9, "2024-01-01T00:00:02Z", model = "ipaddress"))
+    assert not mirror.apply_event(event("created", 9, "2024-01-01T00:00:01Z", model = "ipaddress"))
+
+    assert mirror.objects["ip_address"] == {}
+
+
+def test_device_interfaces_are_ignored():
+    mirror = cli.NetboxMirror("mirror.json")
+
+    assert not mirror.apply_event(event("created", 1, "2024-01-01T00:00:01Z", model = "interface", device = { "id": 1 }, virtual_machine = None))
+    assert mirror.apply_event(event("created", 2, "2024-01-01T00:00:01Z", model = "vminterface", virtual_machine = { "id": 1 }))
+
+    assert list(mirror.objects["interface"]) == [ "2" ]
+
+
+def test_save_and_load(tmp_path):
+    mirror = cli.NetboxMirror(str(tmp_path / "mirror.json"))
+    mirror.apply_event(event("created", 1, "2024-01-01T00:00:01Z", name = "vm1", cluster = { "id": 3 }, custom_fields = { "vcenter_persistent_id": "u1" }))
+    mirror.save()
+
+    vm = cli.NetboxMirror.load(str(tmp_path / "mirror.json")).records("virtual_machine")[0]
+
+    assert vm.name == "vm1"
+    assert vm.cluster.id == 3
+    assert vm.custom_fields.get("vcenter_persistent_id") == "u1"
+
+
+@pytest.fixture
+def server():
+    server = WebhookServer( ("127.0.0.1", 0), cli.NetboxMirror("mirror.json"), "secret" )
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def post(server, body, secret = "secret"):
+    signature = hmac.new(secret.encode("utf-8"), body, hashlib.sha512).hexdigest()
+    request = urllib.request.Request(f"http://127.0.0.1:{server.server_address[1]}/", data = body, headers = { "X-Hook-Signature": signature })
+    try:
+        return urllib.request.urlopen(request).status
+    except urllib.error.HTTPError as ex:
+        return ex.code
+
+
+def test_webhooks(server):
+    body = json.dumps(event("created", 1, "2024-01-01T00:00:01Z")).encode("utf-8")
+
+    assert post(server, body, secret = "wrong") == 403
+    assert post(server, b"[1, 2]") == 400
+    assert post(server, b"not json") == 400
+    assert post(server, body) == 204
+
+    status = json.loads(urllib.request.urlopen(f"http://127.0.0.1:{server.server_address[1]}/").read())
+    assert status["objects"]["virtual_machine"] == 1
@@ -0,0 +1,117 @@
+import logging
+
+import pytest
+
+from netbox_sync import cli
+
+
+@pytest.fixture
+def journal(tmp_path, monkeypatch):
+    monkeypatch.setattr(cli, "logger", logging.getLogger())
+    journal = cli.RunJournal(str(tmp_path / "journal.jsonl"))
+    journal.open(resume = False)
+    monkeypatch.setattr(cli, "journal", journal)
+    return journal
+
+
+def make_plan():
+    # A new cluster, with a new VM in it, with one interface and an IP address, and an unrelated VM update
+    plan = cli.ChangePlan()
+    cluster = plan.add("vcenter_cluster:c2", "create", "cluster", data = { "name": "c2" })
+    plan.add_unit("vcenter_cluster:c2", "create", "c2", "domain-c2")
+    vm = plan.add("vcenter_vm:u1", "create", "virtual_machine", depends_on = [ cluster ],
+                  data = { "name": "vm1", "cluster": { "$ref": cluster } })
+    interface = plan.add("vcenter_vm:u1", "create", "interface", depends_on = [ vm ],
+                         data = { "name": "Network adapter 1", "virtual_machine": { "$ref": vm } })
+    plan.add("vcenter_vm:u1", "assign_ip", "ip_address", target = 500, depends_on = [ interface ],
+             data = { "interface": { "$ref": interface } })
+    plan.add_unit("vcenter_vm:u1", "create", "vm1", "u1")
+    plan.add("netbox_vm:10", "update", "virtual_machine", target = 10, data = { "vcpus": 2 })
+    plan.add_unit("netbox_vm:10", "update", "vm2", "u2")
+    return plan
+
+
+def group_by_unit(changes):
+    changes_by_unit = {}
+    for change in changes:
+        changes_by_unit.setdefault(change["unit"], []).append(change)
+    return changes_by_unit
+
+
+def test_dependency_levels():
+    plan = make_plan()
+    applier = cli.PlanApplier(plan, group_by_unit(plan.changes), concurrency = 1, batch_size = 50)
+
+    levels = [ [ x["id"] for x in level ] for level in applier._dependency_levels() ]
+
+    assert levels == [ [ 1, 5 ], [ 2 ], [ 3 ], [ 4 ] ]
+
+
+def test_dependency_levels_with_dependencies_outside_the_run():
+    # When resuming, the cluster was created by the interrupted run, so the VM has nothing to wait for
+    plan = make_plan()
+    changes = [ x for x in plan.changes if x["unit"] != "vcenter_cluster:c2" ]
+    applier = cli.PlanApplier(plan, group_by_unit(changes), concurrency = 1, batch_size = 50)
+
+    levels = [ [ x["id"] for x in level ] for level in applier._dependency_levels() ]
+
+    assert levels == [ [ 2, 5 ], [ 3 ], [ 4 ] ]
+
+
+def test_resolve_refs_to_created_objects(journal):
+    plan = make_plan()
+    applier = cli.PlanApplier(plan, group_by_unit(plan.changes), concurrency = 1, batch_size = 50)
+
+    applier._applied_change(plan.changes[0], created_id = 7)
+    applier._applied_change(plan.changes[1], created_id = 42)
+
+    assert applier._resolve(plan.changes[1]["data"]) == { "name": "vm1", "cluster": 7 }
+    assert applier._resolve(plan.changes[2]["data"]) == { "name": "Network adapter 1", "virtual_machine": 42 }
+    assert journal.is_done("vcenter_cluster:c2")
+    assert not journal.is_done("vcenter_vm:u1")
+
+
+def test_resolve_refs_to_objects_created_by_the_interrupted_run(journal, monkeypatch):
+    plan = make_plan()
+    applier = cli.PlanApplier(plan, group_by_unit(plan.changes[1:]), concurrency = 1, batch_size = 50)
+
+    class Record:
+        id = 7
+
+    monkeypatch.setattr(applier, "_find_existing", lambda object_type, data: Record() if data["name"] == "c2" else None)
+
+    assert applier._resolve(plan.changes[1]["data"])["cluster"] == 7
+    with pytest.raises(LookupError):
+        applier._resolve(plan.changes[2]["data"])
+
+
+def test_plan_save_and_load(tmp_path):
+    plan = make_plan()
+    plan.save(str(tmp_path / "plan.json"))
+
+    loaded = cli.ChangePlan.load(str(tmp_path / "plan.json"))
+
+    assert loaded.units == plan.units
+    assert loaded.changes == plan.changes
+    assert loaded.created == plan.created
+
+
+def test_failed_bulk_create_looks_for_the_created_objects(journal, monkeypatch):
+    # netbox committed the bulk create, but the response was lost
+    plan = make_plan()
+    applier = cli.PlanApplier(plan, group_by_unit(plan.changes), concurrency = 1, batch_size = 50)
+
+    class Record:
+        id = 7
+
+    class Endpoint:
+        def create(self, data):
+            if isinstance(data, list):
+                raise ConnectionError("Connection reset by peer")
+            raise AssertionError("The cluster was created again")
+
+    monkeypatch.setattr(cli, "_netbox_endpoint", lambda object_type: Endpoint())
+    monkeypatch.setattr(applier, "_find_existing", lambda object_type, data: Record())
+    applier._apply_batch("create", "cluster", plan.changes[:1])
+
+    assert applier.created_ids == { plan.changes[0]["id"]: 7 }
@@ -0,0 +1,32 @@
+import socket
+
+import pytest
+import requests
+
+from netbox_sync.retry import TimeoutHTTPAdapter
+
+
+@pytest.fixture
+def unresponsive_server():
+    # Accepts connections, but never responds
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(1)
+    yield f"http://127.0.0.1:{server.getsockname()[1]}/"
+    server.close()
+
+
+def test_requests_time_out(unresponsive_server):
+    session = requests.Session()
+    session.mount("http://", TimeoutHTTPAdapter(timeout = 0.1))
+
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        session.get(unresponsive_server)
+
+
+def test_timeout_of_the_request_is_kept(unresponsive_server):
+    session = requests.Session()
+    session.mount("http://", TimeoutHTTPAdapter(timeout = 60))
+
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        session.get(unresponsive_server, timeout = 0.1)